@@ -4,10 +4,23 @@ import pty
 import subprocess
 import sys
 import time
-import selectors
+import select
 import fcntl
 import errno
-import re
+import signal
+import mmap
+import tempfile
+
+# splice() moves at most this much per call; the pipe is enlarged to match
+SPLICE_CHUNK = 1 << 20
+SPLICE_FLAGS = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_MORE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+# size of the reusable per-direction read buffer used when splice is unavailable
+RELAY_BUFFER_SIZE = 1 << 16
+# most buffers a single writev() accepts
+IOV_MAX = os.sysconf('SC_IOV_MAX')
+# socat -d -d announces each PTY as "<timestamp> socat[pid] N PTY is /dev/pts/N"
+SOCAT_PTY_PREFIX = b' PTY is '
+PTS_DIR = b'/dev/pts/'
 
 
 def set_nonblocking(fd):
@@ -28,11 +41,14 @@ def safe_read(fd, max_bytes=4096):
 
 def safe_write_all(fd, data):
     # write all bytes handling partial writes and EAGAIN/EINTR
+    _write = os.write
+    _sleep = time.sleep
     total = 0
+    size = len(data)
     view = memoryview(data)
-    while total < len(data):
+    while total < size:
         try:
-            n = os.write(fd, view[total:])
+            n = _write(fd, view[total:])
             if n == 0:
                 raise BrokenPipeError
             total += n
@@ -40,7 +56,7 @@ def safe_write_all(fd, data):
             continue
         except BlockingIOError:
             # caller should wait for fd to be writable; sleep briefly
-            time.sleep(0.001)
+            _sleep(0.001)
             continue
         except BrokenPipeError:
             return total
@@ -49,68 +65,199 @@ def safe_write_all(fd, data):
     return total
 
 
+def safe_writev_all(fd, chunks):
+    # write a list of buffers with as few writev() calls as possible; consumes chunks, handling partial writes
+    # and EAGAIN/EINTR in a single except clause
+    _writev = os.writev
+    _sleep = time.sleep
+    total = 0
+    while chunks:
+        try:
+            n = _writev(fd, chunks)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # caller should wait for fd to be writable; sleep briefly
+                _sleep(0.001)
+                continue
+            # destination closed or other error; drop the rest
+            n = 0
+        if n == 0:
+            chunks.clear()
+            return total
+        total += n
+        # drop fully written slices and trim a partially written one
+        while chunks and n >= len(chunks[0]):
+            n -= len(chunks.pop(0))
+        if n:
+            chunks[0] = chunks[0][n:]
+    return total
+
+
+def make_splice_pipe():
+    """
+    Create the intermediate pipe used to splice bytes between two PTY masters. Returns (read_fd, write_fd) or None.
+    """
+    if not hasattr(os, 'splice'):
+        return None
+    pipe_r, pipe_w = os.pipe()
+    try:
+        # raise pipe capacity so a single splice can move a whole burst
+        fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, SPLICE_CHUNK)
+    except (AttributeError, OSError):
+        pass
+    return pipe_r, pipe_w
+
+
+def splice_relay(src_fd, dst_fd, pipe_r, pipe_w):
+    # move bytes src -> pipe -> dst inside the kernel; raises OSError(EINVAL) if the fds do not support splice
+    try:
+        n = os.splice(src_fd, pipe_w, SPLICE_CHUNK, flags=SPLICE_FLAGS)
+    except (InterruptedError, BlockingIOError):
+        return 0
+    except OSError as e:
+        if e.errno == errno.EINVAL:
+            raise
+        return 0
+    _splice = os.splice
+    left = n
+    while left > 0:
+        try:
+            left -= _splice(pipe_r, dst_fd, left, flags=SPLICE_FLAGS)
+        except InterruptedError:
+            continue
+        except BlockingIOError:
+            time.sleep(0.001)
+            continue
+        except OSError as e:
+            # pull the bytes back out of the pipe so it is empty for the next call
+            data = os.read(pipe_r, left)
+            left = 0
+            if e.errno == errno.EINVAL:
+                safe_write_all(dst_fd, data)
+                raise
+    return n
+
+
 def relay_loop(master_a, master_b, proc, timeout_sec=30.0):
-    sel = selectors.DefaultSelector()
-    sel.register(master_a, selectors.EVENT_READ, data=('A', master_b))
-    sel.register(master_b, selectors.EVENT_READ, data=('B', master_a))
+    ep = select.epoll()
+    ep.register(master_a, select.EPOLLIN | select.EPOLLET)
+    ep.register(master_b, select.EPOLLIN | select.EPOLLET)
+    peer = {master_a: master_b, master_b: master_a}
 
-    deadline = time.time() + timeout_sec
+    # one pipe per direction so bytes can stay in kernel space; fall back to read/write if splice is rejected
+    pipes = {master_a: make_splice_pipe(), master_b: make_splice_pipe()}
+    use_splice = all(pipes.values())
+
+    # SIGCHLD wakes epoll through this pipe, so we can block instead of polling the child
+    wake_r, wake_w = os.pipe()
+    set_nonblocking(wake_r)
+    set_nonblocking(wake_w)
+    ep.register(wake_r, select.EPOLLIN | select.EPOLLET)
+    old_sigchld = signal.signal(signal.SIGCHLD, lambda *_: None)
+    old_wakeup_fd = signal.set_wakeup_fd(wake_w)
+
+    # reusable read buffers for the read/write path, one per direction, so steady state allocates nothing
+    views = {master_a: memoryview(bytearray(RELAY_BUFFER_SIZE)), master_b: memoryview(bytearray(RELAY_BUFFER_SIZE))}
+    # slices read during one wakeup, keyed by destination and flushed with a single writev() each
+    pending = {master_a: [], master_b: []}
+
+    # bind hot-path callables to locals once
+    _readv = os.readv
+    _monotonic_ns = time.monotonic_ns
+    _poll = ep.poll
+    _writev_all = safe_writev_all
+    _splice_relay = splice_relay
+
+    deadline_ns = time.monotonic_ns() + int(timeout_sec * 1e9)
     alive = True
+    check_child = True
     try:
         while True:
-            # check child process
-            if proc.poll() is not None:
-                break
-            now = time.time()
-            if now > deadline:
+            # check child process (once up front, then only after SIGCHLD)
+            if check_child:
+                if proc.poll() is not None:
+                    break
+                check_child = False
+            remaining_ns = deadline_ns - _monotonic_ns()
+            if remaining_ns <= 0:
                 # timeout
                 try:
                     proc.kill()
                 except Exception:
                     pass
                 break
-            timeout = max(0, min(0.1, deadline - now))
-            events = sel.select(timeout)
-            for key, mask in events:
-                src_fd = key.fileobj
-                _, dst_fd = key.data
-                data = safe_read(src_fd, 4096)
-                if not data:
-                    # EOF or no data; if EOF, close registration for this fd
-                    # We don't close the destination immediately because other side may still send
+            for src_fd, mask in _poll(remaining_ns * 1e-9):
+                if src_fd == wake_r:
+                    while safe_read(wake_r, 4096):
+                        pass
+                    check_child = True
                     continue
-                # write out, handling partial writes
-                written = 0
-                while written < len(data):
+                dst_fd = peer[src_fd]
+                # drain everything queued on this master in one wakeup instead of one chunk per select()
+                if use_splice:
                     try:
-                        n = os.write(dst_fd, data[written:])
-                        if n == 0:
-                            raise BrokenPipeError
-                        written += n
-                    except InterruptedError:
-                        continue
-                    except BlockingIOError:
-                        # wait a bit before retrying
-                        time.sleep(0.001)
+                        while _splice_relay(src_fd, dst_fd, *pipes[src_fd]):
+                            pass
                         continue
-                    except BrokenPipeError:
-                        # destination closed; stop writing
-                        break
                     except OSError:
-                        # other error, stop
+                        use_splice = False
+                view = views[src_fd]
+                chunks = pending[dst_fd]
+                used = 0
+                # edge-triggered: keep reading until EAGAIN, flushing early whenever the buffer fills up
+                while True:
+                    if used == RELAY_BUFFER_SIZE or len(chunks) >= IOV_MAX:
+                        _writev_all(dst_fd, chunks)
+                        used = 0
+                    try:
+                        size = _readv(src_fd, [view[used:]])
+                    except OSError:
+                        size = 0
+                    if not size:
+                        # EOF or no data; if EOF, close registration for this fd
+                        # We don't close the destination immediately because other side may still send
                         break
-            # small sleep to avoid busy loop when no events
-            if not events:
-                time.sleep(0.001)
+                    chunks.append(view[used:used + size])
+                    used += size
+            # one writev() per destination for everything read in this wakeup
+            for dst_fd, chunks in pending.items():
+                if chunks:
+                    _writev_all(dst_fd, chunks)
     finally:
-        try:
-            sel.unregister(master_a)
-        except Exception:
-            pass
-        try:
-            sel.unregister(master_b)
-        except Exception:
-            pass
+        signal.set_wakeup_fd(old_wakeup_fd)
+        signal.signal(signal.SIGCHLD, old_sigchld)
+        ep.close()
+        for fd in (wake_r, wake_w):
+            try:
+                os.close(fd)
+            except Exception:
+                pass
+        for pipe in pipes.values():
+            if pipe is None:
+                continue
+            for fd in pipe:
+                try:
+                    os.close(fd)
+                except Exception:
+                    pass
+
+
+def parse_socat_pty(line):
+    # return the PTY path announced on one socat stderr line, or None
+    idx = line.find(SOCAT_PTY_PREFIX)
+    if idx >= 0:
+        path = line[idx + len(SOCAT_PTY_PREFIX):].strip()
+    elif PTS_DIR in line:
+        # socat may also print PTY names in different formats, take the /dev/pts/N token
+        tail = line.rpartition(PTS_DIR)[2]
+        path = PTS_DIR + tail[:len(tail) - len(tail.lstrip(b'0123456789'))]
+    else:
+        return None
+    if not path.startswith(b'/dev') or path == PTS_DIR:
+        return None
+    return path.decode()
 
 
 def create_socat_pair(timeout=5.0):
@@ -119,29 +266,36 @@ def create_socat_pair(timeout=5.0):
     """
     try:
         p = subprocess.Popen(['socat', '-d', '-d', 'pty,raw,echo=0', 'pty,raw,echo=0'], stderr=subprocess.PIPE,
-                             stdout=subprocess.DEVNULL, text=True)
+                             stdout=subprocess.DEVNULL)
     except FileNotFoundError:
         return None
 
     slaves = []
-    start = time.time()
-    # Read stderr lines until we have two PTY paths or timeout
+    fd = p.stderr.fileno()
+    set_nonblocking(fd)
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    pending = bytearray()
+    deadline = time.time() + timeout
+    # Read whatever stderr has on each wakeup until we have two PTY paths or timeout
     try:
-        while time.time() - start < timeout and len(slaves) < 2:
-            line = p.stderr.readline()
-            if not line:
-                time.sleep(0.01)
+        while len(slaves) < 2:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not poller.poll(remaining * 1000):
+                break
+            try:
+                chunk = os.read(fd, 65536)
+            except (BlockingIOError, InterruptedError):
                 continue
-            m = re.search(r'(/dev/pts/\d+)', line)
-            if m:
-                path = m.group(1)
-                if path not in slaves:
-                    slaves.append(path)
-            # socat may also print PTY names in different formats, try alternate pattern
-            m2 = re.search(r'PTY is (.+)', line)
-            if m2:
-                path = m2.group(1).strip()
-                if path.startswith('/dev') and path not in slaves:
+            if not chunk:
+                # socat exited
+                break
+            pending += chunk
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                path = parse_socat_pty(line)
+                if path is not None and path not in slaves:
                     slaves.append(path)
     except Exception:
         pass
@@ -160,104 +314,180 @@ def create_socat_pair(timeout=5.0):
     return (p, slaves[0], slaves[1])
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: test_serial.py <path-to-test-binary>")
-        sys.exit(2)
-
-    test_binary = sys.argv[1]
-
-    # Try socat first for a robust PTY pair
-    socat_res = create_socat_pair(timeout=5.0)
+def open_capture_file():
+    # anonymous file for child output: the kernel page cache holds it instead of a growing Python buffer
+    try:
+        return os.open(tempfile.gettempdir(), os.O_TMPFILE | os.O_RDWR, 0o600)
+    except (AttributeError, OSError):
+        fd, path = tempfile.mkstemp()
+        os.unlink(path)
+        return fd
 
-    if socat_res is not None:
-        socat_proc, slave1_name, slave2_name = socat_res
-        print(f"Virtual linked ports (socat): {slave1_name} <-> {slave2_name}")
-        sys.stdout.flush()
 
-        proc = subprocess.Popen([test_binary, slave1_name, slave2_name] + sys.argv[2:], stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE, text=True)
+def send_capture(dst_fd, src_fd, size):
+    # copy the first size bytes of a capture file to dst_fd inside the kernel, handling partial sends and EAGAIN/EINTR
+    _sendfile = os.sendfile
+    offset = 0
+    while offset < size:
         try:
-            # wait for process while socat runs in background linking the PTYs
-            stdout, stderr = proc.communicate(timeout=30)
-        except subprocess.TimeoutExpired:
-            try:
-                proc.kill()
-            except Exception:
-                pass
-            stdout, stderr = proc.communicate()
-        finally:
-            # cleanup socat
-            try:
-                socat_proc.kill()
-            except Exception:
-                pass
-            try:
-                socat_proc.wait(timeout=1)
-            except Exception:
-                pass
-
-    else:
-        # Fallback to internal PTY pair + relay
-        m1, s1 = pty.openpty()
-        m2, s2 = pty.openpty()
-
-        # set masters non-blocking
-        set_nonblocking(m1)
-        set_nonblocking(m2)
+            n = _sendfile(dst_fd, src_fd, offset, size - offset)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                time.sleep(0.001)
+                continue
+            if e.errno in (errno.EINVAL, errno.ENOSYS):
+                # sendfile() refuses some targets (e.g. O_APPEND files); write from a mapping instead
+                with mmap.mmap(src_fd, 0, access=mmap.ACCESS_READ) as m:
+                    return offset + safe_write_all(dst_fd, m[offset:size])
+            return offset
+        if n == 0:
+            break
+        offset += n
+    return offset
 
-        slave1_name = os.ttyname(s1)
-        slave2_name = os.ttyname(s2)
 
-        print(f"Virtual linked ports: {slave1_name} <-> {slave2_name}")
-        sys.stdout.flush()
+def spawn_test_binary(test_binary, slave1, slave2, extra_args, out_fd, err_fd):
+    # close_fds=False (and no preexec_fn/process_group) lets subprocess use posix_spawn instead of fork+exec;
+    # nothing leaks because Python creates fds non-inheritable by default
+    return subprocess.Popen([test_binary, slave1, slave2] + extra_args, stdout=out_fd, stderr=err_fd,
+                            close_fds=False)
 
-        proc = subprocess.Popen([test_binary, slave1_name, slave2_name] + sys.argv[2:], stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE, text=True)
 
-        try:
-            relay_loop(m1, m2, proc, timeout_sec=30.0)
-            # after relay loop completes, wait a short time for the child to exit and collect output
-            try:
-                stdout, stderr = proc.communicate(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-                stdout, stderr = proc.communicate()
-        except Exception as e:
-            try:
-                proc.kill()
-            except Exception:
-                pass
-            stdout, stderr = proc.communicate()
-            print(f"Relay error: {e}", file=sys.stderr)
+def run_with_socat(socat_res, test_binary, extra_args, out_fd, err_fd):
+    """
+    Run the test binary on a socat-linked PTY pair, capturing its output into out_fd/err_fd. Returns (proc, slave1,
+    slave2).
+    """
+    socat_proc, slave1_name, slave2_name = socat_res
+    print(f"Virtual linked ports (socat): {slave1_name} <-> {slave2_name}")
+    sys.stdout.flush()
 
-        # Close master/slave fds
+    proc = spawn_test_binary(test_binary, slave1_name, slave2_name, extra_args, out_fd, err_fd)
+    try:
+        # wait for process while socat runs in background linking the PTYs
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
         try:
-            os.close(m1)
+            proc.kill()
         except Exception:
             pass
+        proc.wait()
+    finally:
+        # cleanup socat
         try:
-            os.close(m2)
+            socat_proc.kill()
         except Exception:
             pass
         try:
-            os.close(s1)
+            socat_proc.wait(timeout=1)
         except Exception:
             pass
+
+    return proc, slave1_name, slave2_name
+
+
+def run_with_relay(test_binary, extra_args, out_fd, err_fd):
+    """
+    Run the test binary on two internal PTY pairs linked by relay_loop(), capturing its output into out_fd/err_fd.
+    Returns (proc, slave1, slave2).
+    """
+    m1, s1 = pty.openpty()
+    m2, s2 = pty.openpty()
+
+    # set masters non-blocking
+    set_nonblocking(m1)
+    set_nonblocking(m2)
+
+    slave1_name = os.ttyname(s1)
+    slave2_name = os.ttyname(s2)
+
+    print(f"Virtual linked ports: {slave1_name} <-> {slave2_name}")
+    sys.stdout.flush()
+
+    proc = spawn_test_binary(test_binary, slave1_name, slave2_name, extra_args, out_fd, err_fd)
+
+    try:
+        relay_loop(m1, m2, proc, timeout_sec=30.0)
+        # after relay loop completes, wait a short time for the child to exit
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    except Exception as e:
         try:
-            os.close(s2)
+            proc.kill()
         except Exception:
             pass
+        proc.wait()
+        print(f"Relay error: {e}", file=sys.stderr)
+
+    # Close master/slave fds
+    try:
+        os.close(m1)
+    except Exception:
+        pass
+    try:
+        os.close(m2)
+    except Exception:
+        pass
+    try:
+        os.close(s1)
+    except Exception:
+        pass
+    try:
+        os.close(s2)
+    except Exception:
+        pass
+
+    return proc, slave1_name, slave2_name
+
+
+def main(argv):
+    args = argv[1:]
+    # --no-relay: require socat to link the PTYs, never fall back to the Python relay
+    no_relay = bool(args) and args[0] == '--no-relay'
+    if no_relay:
+        args = args[1:]
+    if not args:
+        print("Usage: test_serial.py [--no-relay] <path-to-test-binary> [args...]")
+        return 2
+
+    test_binary = args[0]
+    extra_args = args[1:]
+
+    # Try socat first for a robust PTY pair, fall back to the internal relay
+    socat_res = create_socat_pair(timeout=5.0)
+    if socat_res is None and no_relay:
+        print("socat is required with --no-relay", file=sys.stderr)
+        return 2
+
+    # child output goes to anonymous files and is copied out by the kernel once the child has finished
+    out_fd = open_capture_file()
+    err_fd = open_capture_file()
+    if socat_res is not None:
+        proc, slave1_name, slave2_name = run_with_socat(socat_res, test_binary, extra_args, out_fd, err_fd)
+    else:
+        proc, slave1_name, slave2_name = run_with_relay(test_binary, extra_args, out_fd, err_fd)
+    out_size = os.fstat(out_fd).st_size
+    err_size = os.fstat(err_fd).st_size
 
     # Always print child's outputs and return code for diagnostics
     print("=== CHILD STDOUT ===")
-    if stdout:
-        print(stdout)
+    if out_size:
+        # child output never enters Python; sendfile() it straight from the capture file
+        sys.stdout.flush()
+        send_capture(sys.stdout.fileno(), out_fd, out_size)
+        os.write(sys.stdout.fileno(), b"\n")
     else:
         print("<no stdout>")
     print("=== CHILD STDERR ===", file=sys.stderr)
-    if stderr:
-        print(stderr, file=sys.stderr)
+    if err_size:
+        sys.stderr.flush()
+        send_capture(sys.stderr.fileno(), err_fd, err_size)
+        os.write(sys.stderr.fileno(), b"\n")
     else:
         print("<no stderr>", file=sys.stderr)
 
@@ -265,17 +495,38 @@ if __name__ == '__main__':
     sys.stdout.flush()
     sys.stderr.flush()
 
-    # write small log for CI inspection
+    # write small log for CI inspection. sendfile() rejects O_APPEND targets, so the entry is appended under an
+    # exclusive lock instead, which also keeps concurrent runners from interleaving
     try:
-        with open('/tmp/hyserial_test_runner.log', 'a') as f:
-            f.write(f"Binary: {test_binary} args: {sys.argv[2:]}\n")
-            f.write(f"Slave ports: {slave1_name} {slave2_name}\n")
-            f.write("STDOUT:\n")
-            f.write(stdout or "<no stdout>\n")
-            f.write("STDERR:\n")
-            f.write((stderr or "<no stderr>\n") + "\n")
-            f.write(f"Exit code: {proc.returncode}\n---\n")
+        log_fd = os.open('/tmp/hyserial_test_runner.log', os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(log_fd, fcntl.LOCK_EX)
+            os.lseek(log_fd, 0, os.SEEK_END)
+            os.writev(log_fd, [
+                f"Binary: {test_binary} args: {extra_args}\n".encode(),
+                f"Slave ports: {slave1_name} {slave2_name}\n".encode(),
+                b"STDOUT:\n",
+            ])
+            if out_size:
+                send_capture(log_fd, out_fd, out_size)
+            else:
+                os.write(log_fd, b"<no stdout>\n")
+            os.write(log_fd, b"STDERR:\n")
+            if err_size:
+                send_capture(log_fd, err_fd, err_size)
+            else:
+                os.write(log_fd, b"<no stderr>\n")
+            os.write(log_fd, f"\nExit code: {proc.returncode}\n---\n".encode())
+        finally:
+            os.close(log_fd)
     except Exception:
         pass
 
-    sys.exit(proc.returncode if proc.returncode is not None else 1)
+    os.close(out_fd)
+    os.close(err_fd)
+
+    return proc.returncode if proc.returncode is not None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))